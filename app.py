@@ -1,13 +1,19 @@
 import streamlit as st
 import google.generativeai as genai
-from supabase import create_client, Client
+from supabase import create_client, Client, ClientOptions
+import asyncio
 import os
+import re
 import hashlib
-import pdfplumber
+import fitz  # PyMuPDF
 from io import BytesIO
 from dotenv import load_dotenv
 load_dotenv()
 import io
+import logging
+
+logger = logging.getLogger(__name__)
+APP_DEBUG = bool(os.getenv("APP_DEBUG"))
 
 # --- Initialize Google Gemini AI ---
 API_KEY = os.getenv("GEMINI_API_KEY")
@@ -21,26 +27,44 @@ if not API_KEY or not SUPABASE_URL or not SUPABASE_KEY:
     st.stop()
 
 # Initialize Supabase Client
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Module-level singleton: the underlying httpx clients keep connections
+# alive, so repeated table/storage calls reuse the same TCP/TLS session
+supabase: Client = create_client(
+    SUPABASE_URL,
+    SUPABASE_KEY,
+    options=ClientOptions(postgrest_client_timeout=10, storage_client_timeout=10),
+)
 # Configure Gemini AI
 genai.configure(api_key=API_KEY)
+# Shared Gemini model instance, reused across all analysis calls
+MODEL = genai.GenerativeModel("gemini-1.5-pro")
 
 # --- Helper Functions ---
-def hash_file(file_bytes):
-    """Generate SHA-256 hash for a file."""
-    hasher = hashlib.sha256()
-    hasher.update(file_bytes)
-    return hasher.hexdigest()
-
-def file_hash_exists(file_hash):
-    """Check if a file hash already exists in the database."""
-    response = supabase.table("filehashes").select("file_hash").eq("file_hash", file_hash).execute()
-    return len(response.data) > 0
-
-def extract_text_from_pdf(uploaded_file):
-    """Extract text from a PDF file."""
-    with pdfplumber.open(uploaded_file) as pdf:
-        text = "\n".join([page.extract_text() for page in pdf.pages if page.extract_text()])
+def hash_file(fileobj):
+    """Generate SHA-256 hash for a file-like object.
+
+    Uses hashlib.file_digest, which streams the file through an optimized C
+    loop and picks up OpenSSL's hardware-accelerated SHA-256 when available.
+    Leaves the file position at EOF; callers that read afterwards must seek.
+    """
+    fileobj.seek(0)
+    return hashlib.file_digest(fileobj, "sha256").hexdigest()
+
+def extract_text_from_pdf(file_bytes, max_pages=5):
+    """Extract text from a PDF file given its raw bytes.
+
+    Resumes are rarely longer than a couple of pages, so extraction is
+    capped at max_pages to bound the cost of oversized documents.
+    """
+    doc = fitz.open(stream=file_bytes, filetype="pdf")
+    try:
+        # fitz.Document is not thread-safe, so pages extract sequentially
+        num_pages = min(doc.page_count, max_pages)
+        text = "\n".join(
+            t for i in range(num_pages) if (t := doc[i].get_text("text"))
+        )
+    finally:
+        doc.close()
     return text
 
 
@@ -48,16 +72,31 @@ MAX_FILE_SIZE = 10 * 1024 * 1024
 
 def file_exists_in_supabase(file_name, email):
     try:
-        response = supabase.storage.from_("resumes").list(f"resumes/{email}/")
-        existing_files = [file['name'] for file in response]
-        return file_name in existing_files
+        # Single indexed row lookup instead of listing all objects in storage
+        response = (
+            supabase.table("filehashes")
+            .select("file_name", count="exact")
+            .eq("email", email)
+            .eq("file_name", file_name)
+            .limit(1)
+            .execute()
+        )
+        return (response.count or 0) > 0
     except Exception as e:
         st.error(f"Error checking file existence: {e}")
         return False
+@st.cache_data(ttl=60)
 def get_uploaded_files(email):
     try:
-        response = supabase.storage.from_("resumes").list(f"resumes/{email}/")
-        return [file["name"] for file in response] if response else []
+        # Indexed table query instead of listing the storage bucket
+        response = (
+            supabase.table("filehashes")
+            .select("file_name")
+            .eq("email", email)
+            .order("file_name")
+            .execute()
+        )
+        return [row["file_name"] for row in response.data] if response.data else []
     except Exception as e:
         st.error(f"Error fetching uploaded files: {e}")
         return []
@@ -68,62 +107,192 @@ def delete_file_from_supabase(file_name, email):
 
         # Remove the file hash from the database (optional)
         supabase.table("filehashes").delete().eq("file_name", file_name).eq("email", email).execute()
-        
+
+        # Drop cached lookups that are now stale
+        get_uploaded_files.clear()
+
         st.success(f"{file_name} deleted successfully!")
     except Exception as e:
         st.error(f"Error deleting {file_name}: {e}")
 
-# Function to store file hash in the database
-def store_file_hash_in_database(file_name, file_hash, email):
+# Function to store file hashes in the database
+def store_file_hashes_in_database(rows):
+    """Record file hashes and return the set of hashes actually inserted.
+
+    Relies on a UNIQUE(file_hash) constraint on filehashes: dedup happens
+    server-side in one round-trip instead of a SELECT-then-INSERT, which
+    was both racy and an extra query per file. Duplicate hashes are
+    reported with a warning and excluded from the returned set.
+    """
     try:
-        data = {
-            "file_name": file_name,
-            "file_hash": file_hash,
-            "email": email
-        }
-        response = supabase.table("filehashes").insert(data).execute()
-        
-        st.success(f"Hash for {file_name} stored successfully in the database!")
+        response = (
+            supabase.table("filehashes")
+            .upsert(rows, on_conflict="file_hash", ignore_duplicates=True)
+            .execute()
+        )
+        inserted = {row["file_hash"] for row in (response.data or [])}
+        for row in rows:
+            if row["file_hash"] not in inserted:
+                st.warning(f"{row['file_name']} has already been uploaded.")
+
+        if APP_DEBUG:
+            logger.debug("Stored %d of %d file hash(es) in the database", len(inserted), len(rows))
+        return inserted
     except Exception as e:
-        st.error(f"Error storing hash: {e}")
+        st.error(f"Error storing hashes: {e}")
+        return set()
 
-# Function to upload file to Supabase
-def upload_file_to_supabase(file, file_name, email):
-    try:
-        file_content = file.read()  # Read file as bytes
-        file_hash = hash_file(file_content)  # Generate hash
+# Function to upload files to Supabase
+def upload_files_to_supabase(files, email):
+    """Upload a batch of (file_bytes, file_name, file_hash) tuples.
 
-        if file_exists_in_supabase(file_name, email):
-            st.warning(f"{file_name} already exists in Supabase. Skipping upload.")
-        else:
+    Hash rows are upserted before anything touches storage, and only files
+    whose hash was actually inserted get uploaded — duplicate content never
+    leaves an orphaned, untracked storage object behind. Returns the names
+    of the files that were uploaded and are now tracked.
+    """
+    try:
+        new_files = []
+        for file_bytes, file_name, file_hash in files:
+            if file_exists_in_supabase(file_name, email):
+                st.warning(f"{file_name} already exists in Supabase. Skipping upload.")
+            else:
+                new_files.append((file_bytes, file_name, file_hash))
+
+        # Record all file hashes in one round-trip before uploading
+        rows = [
+            {"file_name": file_name, "file_hash": file_hash, "email": email}
+            for _, file_name, file_hash in new_files
+        ]
+        inserted = store_file_hashes_in_database(rows) if rows else set()
+
+        uploaded_names = []
+        for file_bytes, file_name, file_hash in new_files:
+            if file_hash not in inserted:
+                continue  # duplicate content; warning already shown
             file_path = f"resumes/{email}/{file_name}"
-            response = supabase.storage.from_("resumes").upload(file_path, file_content)
+            supabase.storage.from_("resumes").upload(file_path, file_bytes)
             st.success(f"{file_name} uploaded successfully!")
+            uploaded_names.append(file_name)
+
+        # Drop cached lookups that are now stale
+        get_uploaded_files.clear()
 
-        # Store file hash in database
-        store_file_hash_in_database(file_name, file_hash, email)
+        return uploaded_names
 
     except Exception as e:
-        st.error(f"Error uploading {file_name}: {e}")
+        st.error(f"Error uploading files: {e}")
+        return []
 
 
 
-def analyze_resume(file_text, job_description):
-    """Analyze resume against job description using Gemini AI."""
-    prompt = f"""
+# Cap on concurrent Gemini requests so batches don't hit rate limits
+MAX_CONCURRENT_ANALYSES = 8
+
+# Cap on resume characters sent to Gemini (~4k tokens at ~4 chars/token)
+MAX_PROMPT_CHARS = 16000
+
+def clean_resume_text(text):
+    """Normalize whitespace and cap length before prompting Gemini.
+
+    PDF extraction often yields runs of spaces and blank lines plus trailing
+    boilerplate; collapsing them and truncating to MAX_PROMPT_CHARS keeps
+    prompt tokens (and so prefill time and cost) bounded.
+    """
+    text = re.sub(r"[ \t]+", " ", text)
+    text = re.sub(r"\n{3,}", "\n\n", text)
+    return text.strip()[:MAX_PROMPT_CHARS]
+
+def build_analysis_prompt(file_text, job_description):
+    """Build the single-resume analysis prompt."""
+    return f"""
     Analyze the following resume in comparison to the job description provided.
     Provide feedback on skill matching, strengths, and improvements.
-    
+
     Resume:
-    {file_text}
-    
+    {clean_resume_text(file_text)}
+
     Job Description:
     {job_description}
     """
-    model = genai.GenerativeModel("gemini-1.5-pro")
-    response = model.generate_content(prompt)
+
+async def analyze_resume_async(file_text, job_description):
+    """Analyze resume against job description using Gemini AI."""
+    response = await MODEL.generate_content_async(build_analysis_prompt(file_text, job_description))
     return response.text if response else "Error generating analysis."
 
+def analyze_resume_stream(file_text, job_description):
+    """Yield analysis text chunks as Gemini generates them."""
+    response = MODEL.generate_content(build_analysis_prompt(file_text, job_description), stream=True)
+    for chunk in response:
+        if chunk.text:
+            yield chunk.text
+
+async def analyze_many(pairs):
+    """Analyze multiple (resume_text, job_description) pairs concurrently."""
+    sem = asyncio.Semaphore(MAX_CONCURRENT_ANALYSES)
+
+    async def analyze_one(file_text, job_description):
+        async with sem:
+            return await analyze_resume_async(file_text, job_description)
+
+    return await asyncio.gather(*(analyze_one(r, j) for r, j in pairs))
+
+def analyze_resumes_batch(resume_texts, job_description):
+    """Analyze several resumes against one job description in a single Gemini call.
+
+    The job description is sent once and all resumes share one round-trip;
+    returns one feedback string per resume, in input order. Falls back to
+    concurrent per-resume calls via analyze_many when the batched response
+    can't be split back into per-resume sections.
+    """
+    numbered = "\n\n---\n\n".join(
+        f"Resume {i + 1}:\n{clean_resume_text(text)}" for i, text in enumerate(resume_texts)
+    )
+    prompt = f"""
+    Analyze each of the following resumes in comparison to the job description
+    provided. For every resume, start its feedback with a line reading exactly
+    "Resume <number>:" and cover skill matching, strengths, and improvements.
+
+    Job Description:
+    {job_description}
+
+    {numbered}
+    """
+    response = MODEL.generate_content(prompt)
+    if response:
+        sections = split_batch_response(response.text, len(resume_texts))
+        if sections is not None:
+            return sections
+    # Model ignored the heading format (or the call failed); fan the
+    # resumes out as individual concurrent requests instead
+    return asyncio.run(analyze_many([(text, job_description) for text in resume_texts]))
+
+def split_batch_response(text, num_resumes):
+    """Split a batched analysis into per-resume sections by numbered headings.
+
+    Returns None when no headings are found, so the caller can fall back.
+    """
+    headings = list(re.finditer(r"(?mi)^\W*resume\s+(\d+)\b.*$", text))
+    if not headings:
+        return None
+    sections = [""] * num_resumes
+    for i, match in enumerate(headings):
+        index = int(match.group(1)) - 1
+        end = headings[i + 1].start() if i + 1 < len(headings) else len(text)
+        if 0 <= index < num_resumes:
+            sections[index] = text[match.end():end].strip()
+    return sections
+
+# Cached wrappers keyed by content hash, so Streamlit reruns (checkbox
+# toggles, text edits) don't re-extract the PDF or re-call Gemini.
+# Underscore-prefixed args are excluded from the cache key.
+@st.cache_data(show_spinner=False)
+def extract_text_cached(file_hash, _file_bytes):
+    """Extract PDF text once per unique file content."""
+    return extract_text_from_pdf(_file_bytes)
+
+
 # --- Streamlit UI ---
 st.title("📄 AI-Powered Resume Analyzer")
 
@@ -157,6 +326,7 @@ if st.session_state["user"]:
     st.sidebar.write(f"Logged in as: {st.session_state['user'].email}")
     if st.sidebar.button("Logout"):
         st.session_state["user"] = None
+        st.session_state.pop("uploaded_files", None)
 else:
     option = st.sidebar.radio("Login or Sign Up", ["Login", "Sign Up"])
     email = st.sidebar.text_input("Email")
@@ -172,8 +342,12 @@ if st.session_state.get("user"):  # Ensure user is logged in
     email = st.session_state["user"].email
     st.sidebar.subheader("📂 Your Uploaded Resumes")
 
-    # Retrieve user's uploaded files
-    uploaded_files = get_uploaded_files(email)
+    # Session-held upload list is the source of truth: seeded once from the
+    # database, then updated in place after upload/delete so mutations don't
+    # force a full-script rerun
+    if "uploaded_files" not in st.session_state:
+        st.session_state["uploaded_files"] = get_uploaded_files(email)
+    uploaded_files = st.session_state["uploaded_files"]
 
     if uploaded_files:
         selected_file = st.sidebar.selectbox("Select a file:", uploaded_files)
@@ -182,23 +356,34 @@ if st.session_state.get("user"):  # Ensure user is logged in
 
         if st.sidebar.button("🗑️ Delete File"):
             delete_file_from_supabase(selected_file, email)
+            if selected_file in st.session_state["uploaded_files"]:
+                st.session_state["uploaded_files"].remove(selected_file)
+            # Rerun so the rest of the script never sees the deleted file;
+            # the cached lookups keep the rerun cheap
             st.rerun()
     else:
         st.sidebar.info("No resumes uploaded yet.")
 
     # File upload handling
     st.subheader("📤 Upload Resume")
-    uploaded_file = st.file_uploader("Upload Resume (PDF)", type="pdf")
-    
-    if uploaded_file:
-        file_bytes = uploaded_file.getvalue()
-        file_hash = hash_file(file_bytes)
-
-        if file_hash_exists(file_hash):
-            st.warning("This resume has already been uploaded.")
-        else:
-            if st.checkbox("Upload to Supabase"):
-                upload_file_to_supabase(uploaded_file, uploaded_file.name, email)
+    uploaded_pdfs = st.file_uploader("Upload Resume (PDF)", type="pdf", accept_multiple_files=True)
+
+    if uploaded_pdfs:
+        # Read and hash each upload once; duplicate hashes are caught
+        # server-side by the unique constraint during the upsert
+        new_files = [
+            (uploaded_file.getvalue(), uploaded_file.name, hash_file(uploaded_file))
+            for uploaded_file in uploaded_pdfs
+        ]
+
+        if new_files and st.checkbox("Upload to Supabase"):
+            uploaded_names = upload_files_to_supabase(new_files, email)
+            for file_name in uploaded_names:
+                if file_name not in st.session_state["uploaded_files"]:
+                    st.session_state["uploaded_files"].append(file_name)
+            if uploaded_names:
+                # Rerun so the sidebar selectbox picks up the new files and
+                # selected_file is defined before the analysis section runs
                 st.rerun()
 
     # Resume analysis section
@@ -210,16 +395,36 @@ if st.session_state.get("user"):  # Ensure user is logged in
         
         if response:
             file_bytes = response
-            resume_text = extract_text_from_pdf(BytesIO(file_bytes))
+            selected_file_hash = hash_file(BytesIO(file_bytes))
+            resume_text = extract_text_cached(selected_file_hash, file_bytes)
 
             st.subheader("🔍 Extracted Resume Text")
             st.text_area("Resume Content", resume_text, height=200)
 
             job_description = st.text_area("Paste Job Description", height=200)
             if resume_text and job_description and st.button("Analyze Resume"):
-                with st.spinner("Analyzing..."):
-                    feedback = analyze_resume(resume_text, job_description)
-                    st.subheader("📝 Analysis & Feedback")
-                    st.write(feedback)
+                jd_hash = hashlib.sha256(job_description.encode()).hexdigest()
+                cache_key = (selected_file_hash, jd_hash)
+                analysis_cache = st.session_state.setdefault("analysis_cache", {})
+
+                st.subheader("📝 Analysis & Feedback")
+                if cache_key in analysis_cache:
+                    st.write(analysis_cache[cache_key])
+                else:
+                    # Stream tokens as they arrive; write_stream returns the full text
+                    feedback = st.write_stream(analyze_resume_stream(resume_text, job_description))
+                    analysis_cache[cache_key] = feedback
+
+            if job_description and len(uploaded_files) > 1 and st.button("Analyze All Resumes"):
+                with st.spinner("Analyzing all resumes..."):
+                    resume_texts = []
+                    for file_name in uploaded_files:
+                        data = supabase.storage.from_("resumes").download(f"resumes/{email}/{file_name}")
+                        resume_texts.append(extract_text_cached(hash_file(BytesIO(data)), data))
+                    results = analyze_resumes_batch(resume_texts, job_description)
+                    st.subheader("📝 Analysis & Feedback (All Resumes)")
+                    for file_name, feedback in zip(uploaded_files, results):
+                        st.markdown(f"**{file_name}**")
+                        st.write(feedback)
 else:
     st.warning("Please log in to upload or manage resumes.")